@@ -3,14 +3,6 @@ import argparse
 import logging
 import sys
 
-import kmt.exception as exception
-import kmt.util as util
-import kmt.core as core
-import kmt.step_handlers as step_handlers
-import kmt.step_support as step_support
-import kmt.pipeline_support as pipeline_support
-import kmt.j2support as j2support
-
 logger = logging.getLogger(__name__)
 
 def main():
@@ -32,6 +24,15 @@ def main():
 
     args = parser.parse_args()
 
+    # Only load the pipeline modules (and yaml, jinja2, etc.) once the arguments are parsed,
+    # so help and argument errors return without the import cost.
+    # The handler modules register themselves with core on import
+    import kmt.core as core
+    import kmt.step_handlers as step_handlers
+    import kmt.step_support as step_support
+    import kmt.pipeline_support as pipeline_support
+    import kmt.j2support as j2support
+
     # Capture argument options
     debug = args.debug
     path = args.path
@@ -50,8 +51,9 @@ def main():
         manifests = pipeline.run()
 
         logger.debug(f"Received {len(manifests)} manifests from the pipeline")
-        for manifest in manifests:
-            print(manifest)
+
+        # Write the output in a single call, rather than a print per manifest
+        sys.stdout.write("".join([f"{manifest}\n" for manifest in manifests]))
 
     except BrokenPipeError as e:
         try:
@@ -1,5 +1,4 @@
 import os
-import yaml
 import jinja2
 import inspect
 import copy
@@ -19,6 +18,21 @@ default_pipeline_support_handlers = []
 default_filters = {}
 default_globals = {}
 
+class ManifestKeys:
+    """
+    The identifying fields of a manifest, used when searching manifests
+    """
+    __slots__ = ("group", "version", "kind", "api_version", "namespace", "name", "alias")
+
+    def __init__(self, group, version, kind, api_version, namespace, name, alias):
+        self.group = group
+        self.version = version
+        self.kind = kind
+        self.api_version = api_version
+        self.namespace = namespace
+        self.name = name
+        self.alias = alias
+
 class Manifest:
     def __init__(self, source, *, pipeline):
         util.validate(isinstance(source, dict), "Invalid source passed to Manifest init")
@@ -30,6 +44,9 @@ class Manifest:
         self.tags = set()
         self.local_vars = {}
 
+        # Jinja2 environment for templating against this manifest. Created on first use
+        self._environment = None
+
         # Require a minimum of a metadata dictionary and name to create this
         # manifest.
         if "metadata" not in self.spec:
@@ -82,13 +99,20 @@ class Manifest:
         effective_vars.update(self.local_vars)
         effective_vars.update(builtin)
 
-        overlay = self.pipeline.common.environment.overlay()
-        overlay.kmt_pipeline = self.pipeline
-        overlay.kmt_manifest = self
+        # The overlay only depends on the pipeline and manifest, which don't change for
+        # this manifest, so it can be reused between templaters
+        if self._environment is None:
+            self._environment = self.pipeline.common.environment.overlay()
+            self._environment.kmt_pipeline = self.pipeline
+            self._environment.kmt_manifest = self
 
-        return Templater(overlay, effective_vars)
+        return Templater(self._environment, effective_vars)
 
-    def get_info(self, default_value=None):
+    def get_keys(self, default_value=None):
+        """
+        Returns the identifying fields for the manifest. Cheaper than get_info, as it
+        only reads the fields required for searching and doesn't modify the manifest
+        """
         # api version
         # Don't use the 'default_value' yet as we want to know whether it exists first
         api_version = self.spec.get("apiVersion")
@@ -109,37 +133,42 @@ class Manifest:
         if api_version is None:
             api_version = default_value
 
-        # Kind
-        kind = self.spec.get("kind", default_value)
-
         # metadata
         metadata = self.get_metadata()
 
-        # Name and Namespace
-        name = metadata.get("name", default_value)
-        namespace = metadata.get("namespace", default_value)
+        # Manifest alias
+        annotations = metadata.get("annotations")
+        if annotations is None:
+            annotations = {}
 
-        # Annotations
-        annotations = self.get_annotations()
+        if not isinstance(annotations, dict):
+            raise exception.KMTManifestException("Invalid annotations type on manifest")
 
-        # Labels
-        labels = self.get_labels()
+        return ManifestKeys(
+            group=group,
+            version=version,
+            kind=self.spec.get("kind", default_value),
+            api_version=api_version,
+            namespace=metadata.get("namespace", default_value),
+            name=metadata.get("name", default_value),
+            alias=annotations.get("kmt/alias", default_value)
+        )
 
-        # Manifest alias
-        alias = annotations.get("kmt/alias", default_value)
+    def get_info(self, default_value=None):
+        keys = self.get_keys(default_value=default_value)
 
         return {
-            "group": group,
-            "version": version,
-            "kind": kind,
-            "api_version": api_version,
-            "namespace": namespace,
-            "name": name,
-            "alias": alias,
+            "group": keys.group,
+            "version": keys.version,
+            "kind": keys.kind,
+            "api_version": keys.api_version,
+            "namespace": keys.namespace,
+            "name": keys.name,
+            "alias": keys.alias,
             "manifest": self,
-            "metadata": metadata,
-            "annotations": annotations,
-            "labels": labels
+            "metadata": self.get_metadata(),
+            "annotations": self.get_annotations(),
+            "labels": self.get_labels()
         }
 
     def refresh_metadata(self):
@@ -229,25 +258,22 @@ class Common:
     def __init__(self):
         self.environment = jinja2.Environment(undefined=jinja2.StrictUndefined, keep_trailing_newline=True)
 
-        # Make sure the jinja2 environment has these properties
-        self.environment.extend(kmt_pipeline=None, kmt_manifest=None)
+        # Make sure the jinja2 environment has these properties. The file cache is shared by
+        # the overlay environments, so lasts for the pipeline run
+        self.environment.extend(kmt_pipeline=None, kmt_manifest=None, kmt_file_cache={})
 
         self.handlers = copy.copy(default_handlers)
         self.step_support_handlers = copy.copy(default_step_support_handlers)
         self.pipeline_support_handlers = copy.copy(default_pipeline_support_handlers)
 
-        for filter_name in default_filters:
-            self.environment.filters[filter_name] = default_filters[filter_name]
-
-        for global_name in default_globals:
-            self.environment.globals[global_name] = default_globals[global_name]
+        self.environment.filters.update(default_filters)
+        self.environment.globals.update(default_globals)
 
     def add_handlers(self, handlers):
         util.validate(isinstance(handlers, dict), "Invalid handlers passed to add_handlers")
         util.validate((all(x is None or (inspect.isclass(x) and issubclass(x, StepHandler))) for x in handlers.values()), "Invalid handlers passed to add_handlers")
 
-        for key in handlers:
-            self.handlers[key] = handlers[key]
+        self.handlers.update(handlers)
 
     def add_step_support_handlers(self, handlers):
         util.validate(isinstance(handlers, list), "Invalid handlers passed to add_step_support_handlers")
@@ -269,8 +295,7 @@ class Common:
         util.validate(isinstance(filters, dict), "Invalid filters passed to add_filters")
         util.validate(all((callable(x) or x is None) for x in filters.values()), "Invalid filters passed to add_filters")
 
-        for key in filters:
-            self.environment.filters[key] = filters[key]
+        self.environment.filters.update(filters)
 
 class PipelineStepState:
     def __init__(self, pipeline, working_manifests):
@@ -283,6 +308,55 @@ class PipelineStepState:
 
         self.skip_handler = False
 
+        # Cache of templaters by manifest id. Only used while enabled. See get_manifest_templater
+        self._templater_cache = None
+
+    def enable_templater_cache(self, enabled):
+        """
+        Enables or disables reuse of manifest templaters. This should only be enabled while
+        the manifests and vars can't change, such as during the support handler 'pre' calls
+        """
+        self._templater_cache = {} if enabled else None
+
+    def get_manifest_templater(self, manifest):
+        """
+        Returns a templater for the manifest, reusing a previous templater for the manifest
+        if the templater cache is enabled
+        """
+        if self._templater_cache is None:
+            return manifest.get_templater()
+
+        templater = self._templater_cache.get(id(manifest))
+        if templater is None:
+            templater = manifest.get_templater()
+            self._templater_cache[id(manifest)] = templater
+
+        return templater
+
+    def get_manifest_resolver(self, values, resolve):
+        """
+        Returns a callable that takes a manifest and returns resolve(templater), using a
+        templater for that manifest.
+
+        values is the step configuration that resolve uses. If it has no templating, the
+        result is the same for every manifest, so it is only resolved for the first manifest
+        and then reused. Otherwise, it is resolved for each manifest
+        """
+        util.validate(callable(resolve), "Invalid resolve callable passed to get_manifest_resolver")
+
+        if util.contains_template(values):
+            return lambda manifest: resolve(self.get_manifest_templater(manifest))
+
+        resolved = []
+
+        def _resolver(manifest):
+            if len(resolved) == 0:
+                resolved.append(resolve(self.get_manifest_templater(manifest)))
+
+            return resolved[0]
+
+        return _resolver
+
 class PipelineSupportHandler:
     def init(self, pipeline):
         util.validate(isinstance(pipeline, Pipeline), "Invalid pipeline passed to PipelineSupportHandler")
@@ -345,8 +419,15 @@ class Pipeline:
         self._input_manifests = manifests
         self.manifests = []
 
+        # Optional index of the manifests, used to speed up lookups while it is known to be valid.
+        # See util.index_manifests
+        self.manifest_index = None
+
         self.vars = {}
 
+        # Jinja2 environment for templating against the pipeline. Created on first use
+        self._environment = None
+
         #
         # Read and parse configuration file as yaml
         #
@@ -475,11 +556,13 @@ class Pipeline:
         self.root_pipeline = root_pipeline
 
     def get_templater(self):
-        overlay = self.common.environment.overlay()
-        overlay.kmt_pipeline = self
-        overlay.kmt_manifest = None
+        # Reuse the overlay environment, as it doesn't depend on the pipeline vars
+        if self._environment is None:
+            self._environment = self.common.environment.overlay()
+            self._environment.kmt_pipeline = self
+            self._environment.kmt_manifest = None
 
-        return Templater(overlay, self.vars)
+        return Templater(self._environment, self.vars)
 
     def run(self):
 
@@ -495,7 +578,9 @@ class Pipeline:
 
         # Process each of the steps in this pipeline
         for step_outer in self.pipeline_steps:
-            logger.debug(f"Processing step with specification: {step_outer}")
+            # The step specification can be large, so only format it when it'll be logged
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Processing step with specification: {step_outer}")
 
             state = PipelineStepState(pipeline=self, working_manifests=self.manifests.copy())
 
@@ -542,12 +627,16 @@ class Pipeline:
                 raise exception.PipelineRunException(f"Unexpected properties for handler config: {step_inner.keys()}")
 
             # Run pre for any support handlers
+            # These only filter the working manifests, so the manifest templaters can be shared
+            # between them, rather than built by each handler
             logger.debug("Running pre support handlers")
             logger.debug(f"Pipeline manifests: {len(self.manifests)}. Working manifests: {len(state.working_manifests)}")
+            state.enable_templater_cache(True)
             for ss_handler in ss_handlers:
                 logger.debug(f"Calling support handler pre: {ss_handler}")
                 os.chdir(self.configdir)
                 ss_handler.pre()
+            state.enable_templater_cache(False)
 
             # Run the main handler
             if not state.skip_handler:
@@ -587,6 +676,11 @@ class Templater:
         if not isinstance(val, str):
             return val
 
+        # A string without template markers renders to itself, so skip compiling a template.
+        # Strings with a carriage return still go through jinja2, which normalises line endings
+        if not util.has_template_markers(val) and "\r" not in val:
+            return val
+
         template = self._environment.from_string(val)
         output = template.render(template_vars)
 
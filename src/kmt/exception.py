@@ -2,59 +2,64 @@
 Contains common exceptions used by kmt
 """
 
-class PipelineRunException(Exception):
+class KMTException(Exception):
+    """
+    Base class for all kmt exceptions
+    """
+
+class PipelineRunException(KMTException):
     """
     Exception representing a runtime error while processing the pipeline
     """
     pass
 
-class PipelineConfigException(Exception):
+class PipelineConfigException(KMTException):
     """
     Exception representing a config error while processing the pipeline
     """
     pass
 
-class ValidationException(Exception):
+class ValidationException(KMTException):
     """
     Validation of some condition failed
     """
 
-class RecursionLimitException(Exception):
+class RecursionLimitException(KMTException):
     """
     The depth limit for recursion was exceeded
     """
 
-class KMTInternalException(Exception):
+class KMTInternalException(KMTException):
     """
     KMT internal error
     """
 
-class KMTConversionException(Exception):
+class KMTConversionException(KMTException):
     """
     Error performing type conversion
     """
 
-class KMTResolveException(Exception):
+class KMTResolveException(KMTException):
     """
     Error resolving variable references
     """
 
-class KMTManifestException(Exception):
+class KMTManifestException(KMTException):
     """
     Error in the structure or content of the manifest
     """
 
-class KMTUnimplementedException(Exception):
+class KMTUnimplementedException(KMTException):
     """
     Functionality has not been implemented
     """
 
-class KMTTemplateException(Exception):
+class KMTTemplateException(KMTException):
     """
     Error performing templating
     """
 
-class KMTConfigException(Exception):
+class KMTConfigException(KMTException):
     """
     Error in the pipeline configuration
     """
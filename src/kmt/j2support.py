@@ -1,10 +1,6 @@
 import logging
-import hashlib
-import base64
-import json
-import re
-import yaml
 import os
+import json
 
 import kmt.core as core
 import kmt.util as util
@@ -13,40 +9,161 @@ import kmt.yaml_types as yaml_types
 
 from jinja2 import pass_context
 
+# Prefer the SIMD accelerated base64 codec, if available. Otherwise, call binascii
+# directly, rather than through the python wrappers in the base64 module
+try:
+    import pybase64
+
+    def _b64encode(data):
+        return pybase64.b64encode_as_string(data)
+
+    def _b64decode(data):
+        return pybase64.b64decode(data, validate=False)
+except ImportError:
+    import binascii
+
+    def _b64encode(data):
+        return binascii.b2a_base64(data, newline=False).decode("ascii")
+
+    def _b64decode(data):
+        return binascii.a2b_base64(data)
+
 logger = logging.getLogger(__name__)
 
+# Translation table for escaping an ascii string for use in a JSON (or yaml double quoted)
+# string. Equivalent to json.dumps, minus the surrounding quotes
+_json_escape_table = {x: f"\\u{x:04x}" for x in list(range(0x20)) + [0x7f]}
+_json_escape_table.update(str.maketrans({
+    '"': '\\"',
+    "\\": "\\\\",
+    "\n": "\\n",
+    "\r": "\\r",
+    "\t": "\\t",
+    "\b": "\\b",
+    "\f": "\\f"
+}))
+
+def _json_escape(value):
+    if not isinstance(value, str):
+        value = str(value)
+
+    # Non-ascii characters must be escaped as well, as the yaml parser rejects some of them
+    # (C1 controls) and treats others (U+0085, U+2028, U+2029) as line breaks in a double
+    # quoted scalar. Leave those strings to json, which escapes them as \uXXXX
+    if not value.isascii():
+        return json.dumps(value)[1:-1]
+
+    return value.translate(_json_escape_table)
+
 def filter_hash_string(value, hash_type="sha1"):
     return util.hash_string(value, hash_type)
 
+def filter_hash_file(value, hash_type="sha1"):
+    return util.hash_file(value, hash_type)
+
 def filter_base64_encode(value, encoding="utf-8"):
-    bytes = base64.b64encode(str(value).encode(encoding))
-    return bytes.decode("utf-8")
+    return _b64encode(str(value).encode(encoding))
+
+def filter_base64_encode_many(values, encoding="utf-8"):
+    """
+    Base64 encodes each of a list of values, returning the list of encoded strings. The
+    output is the same as b64encode on each value, but all values are encoded in one call
+    """
+    parts = [str(x).encode(encoding) for x in values]
+
+    # Each value is split in to its whole 3 byte groups and a tail of 0 to 2 bytes. The
+    # groups are concatenated and encoded together, as there are no padding boundaries
+    # between them. Each tail is zero filled to a full group and appended, which encodes
+    # to the same leading characters as the padded tail would on its own
+    bodies = []
+    tails = []
+    for part in parts:
+        split = len(part) - len(part) % 3
+        bodies.append(part[:split])
+        if split < len(part):
+            tails.append(part[split:].ljust(3, b"\0"))
+
+    encoded = _b64encode(b"".join(bodies) + b"".join(tails))
+
+    # Split the output using the known lengths of each value
+    result = []
+    offset = 0
+    tail_offset = sum([len(x) for x in bodies]) // 3 * 4
+    for part, body in zip(parts, bodies):
+        length = len(body) // 3 * 4
+        value = encoded[offset:offset + length]
+        offset = offset + length
+
+        remainder = len(part) - len(body)
+        if remainder > 0:
+            # 1 byte encodes to 2 characters and 2 bytes to 3, with '=' padding the rest
+            value = value + encoded[tail_offset:tail_offset + remainder + 1] + "=" * (3 - remainder)
+            tail_offset = tail_offset + 4
+
+        result.append(value)
+
+    return result
 
 def filter_base64_decode(value, encoding="utf-8"):
-    bytes = value.encode("utf-8")
-    return base64.b64decode(bytes).decode(encoding)
+    # Only ascii str values are accepted by the codecs, so encode str values first
+    if isinstance(value, str):
+        value = value.encode("utf-8")
 
-@pass_context
-def global_include_file_str(context, filename, template=False, encoding="utf-8"):
+    return _b64decode(value).decode(encoding)
+
+def _read_file(filename, encoding):
+    with open(filename, "r", encoding=encoding) as file:
+        return file.read()
+
+def _read_file_escaped(filename, encoding):
+    # Escape the content as it is read, so the unescaped content is never held in full.
+    # Text mode reads return whole characters, so chunks can be escaped independently
+    parts = []
     with open(filename, "r", encoding=encoding) as file:
-        content = file.read()
+        for chunk in iter(lambda: file.read(65536), ""):
+            parts.append(_json_escape(chunk))
 
-    if template:
-        template_obj = context.environment.from_string(content)
-        content = template_obj.render(context.parent)
+    return "".join(parts)
 
-    return (json.dumps(str(content)))[1:-1]
+def _read_file_cached(context, filename, encoding, reader):
+    # The cache belongs to the pipeline run, so contents aren't held after the run completes.
+    # Key on the modification time and size, so a changed file is read again
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, encoding, reader)
+
+    cache = context.environment.kmt_file_cache
+    if key not in cache:
+        cache[key] = reader(filename, encoding)
+
+    return cache[key]
 
 @pass_context
-def global_lookup_manifest_name(context, **kwargs):
+def global_include_file_str(context, filename, template=False, encoding="utf-8"):
+    if not template:
+        return _read_file_cached(context, filename, encoding, _read_file_escaped)
 
-    lookup = yaml_types.LookupName(kwargs)
+    # The whole file is needed for templating, so escape after rendering
+    content = _read_file_cached(context, filename, encoding, _read_file)
+
+    template_obj = context.environment.from_string(content)
+    content = template_obj.render(context.parent)
+
+    return _json_escape(content)
 
+def _get_lookup_scope(context):
+    # Lookups are relative to the current manifest, if there is one, otherwise the pipeline
     scope = context.environment.kmt_manifest
     if scope is None:
         scope = context.environment.kmt_pipeline
 
-    item = lookup.resolve(scope)
+    return scope
+
+@pass_context
+def global_lookup_manifest_name(context, **kwargs):
+
+    lookup = yaml_types.LookupName(kwargs)
+
+    item = lookup.resolve(_get_lookup_scope(context))
 
     return item
 
@@ -55,11 +172,7 @@ def global_lookup_manifest(context, **kwargs):
 
     lookup = yaml_types.Lookup(kwargs)
 
-    scope = context.environment.kmt_manifest
-    if scope is None:
-        scope = context.environment.kmt_pipeline
-
-    item = lookup.resolve(scope)
+    item = lookup.resolve(_get_lookup_scope(context))
 
     return item
 
@@ -68,11 +181,7 @@ def global_hash_manifest(context, **kwargs):
 
     lookup = yaml_types.LookupHash(kwargs)
 
-    scope = context.environment.kmt_manifest
-    if scope is None:
-        scope = context.environment.kmt_pipeline
-
-    item = lookup.resolve(scope)
+    item = lookup.resolve(_get_lookup_scope(context))
 
     return item
 
@@ -96,14 +205,20 @@ def global_env(name=None):
 def global_fail(message:str):
     raise exception.KMTTemplateException(message)
 
-core.default_filters["hash_string"] = filter_hash_string
-core.default_filters["b64encode"] = filter_base64_encode
-core.default_filters["b64decode"] = filter_base64_decode
-
-core.default_globals["env"] = global_env
-core.default_globals["include_file_str"] = global_include_file_str
-core.default_globals["lookup_manifest"] = global_lookup_manifest
-core.default_globals["lookup_manifest_name"] = global_lookup_manifest_name
-core.default_globals["hash_manifest"] = global_hash_manifest
-core.default_globals["hash_self"] = global_hash_self
-core.default_globals["fail"] = global_fail
+core.default_filters.update({
+    "hash_string": filter_hash_string,
+    "hash_file": filter_hash_file,
+    "b64encode": filter_base64_encode,
+    "b64encode_many": filter_base64_encode_many,
+    "b64decode": filter_base64_decode
+})
+
+core.default_globals.update({
+    "env": global_env,
+    "include_file_str": global_include_file_str,
+    "lookup_manifest": global_lookup_manifest,
+    "lookup_manifest_name": global_lookup_manifest_name,
+    "hash_manifest": global_hash_manifest,
+    "hash_self": global_hash_self,
+    "fail": global_fail
+})
@@ -1,14 +1,18 @@
 import logging
 import jsonpath_ng
-import itertools
 
 import kmt.util as util
 import kmt.core as core
-import kmt.yaml_types as yaml_types
 import kmt.exception as exception
 
 logger = logging.getLogger(__name__)
 
+# Manifest keys displayed for the sorted manifest order
+_ordering_display_keys = ("group", "version", "kind", "namespace", "name")
+
+# Annotations that we should make sure aren't present on the output manifests
+_cleanup_annotations = frozenset(["kmt/alias", "kmt/pre-hash-name", "kmt/rename-hash"])
+
 class PipelineSupportOrdering(core.PipelineSupportHandler):
     def pre(self):
         pass
@@ -19,37 +23,42 @@ class PipelineSupportOrdering(core.PipelineSupportHandler):
         if not self.pipeline.root_pipeline:
             return
 
-        working = self.pipeline.manifests
-        working = sorted(working, key=lambda x: x.spec.get("name", ""))
-        working = sorted(working, key=lambda x: x.spec.get("namespace", ""))
-        working = sorted(working, key=lambda x: x.spec.get("kind", ""))
-        working = sorted(working, key=lambda x: x.spec.get("version", ""))
-        working = sorted(working, key=lambda x: x.spec.get("group", ""))
-        working = sorted(
-            working,
-            key=lambda x: x.spec.get("kind", "").casefold() != "configmap" and x.spec.get("kind", "").casefold() != "secret"
-        )
-        working = sorted(working, key=lambda x: x.spec.get("kind", "").casefold() != "namespace" )
+        # Nothing to sort
+        if len(self.pipeline.manifests) <= 1:
+            return
 
-        self.pipeline.manifests = working
+        # Sort once on a tuple key, which gives the same order as sorting on each field in turn,
+        # from least to most significant. Namespaces first, then configmaps and secrets, then
+        # everything else, with each group ordered by group, version, kind, namespace and name
+        def _sort_key(manifest):
+            spec = manifest.spec
+            kind = spec.get("kind", "")
+            kind_folded = kind.casefold()
+
+            return (
+                kind_folded != "namespace",
+                kind_folded != "configmap" and kind_folded != "secret",
+                spec.get("group", ""),
+                spec.get("version", ""),
+                kind,
+                spec.get("namespace", ""),
+                spec.get("name", "")
+            )
+
+        # Sort in place, rather than building a new list
+        self.pipeline.manifests.sort(key=_sort_key)
 
         # Display sorted order
         def _get_metadata_str(manifest):
-            keys = [
-                "group",
-                "version",
-                "kind",
-                "namespace",
-                "name",
-            ]
+            keys = manifest.get_keys(default_value="")
 
-            info = manifest.get_info(default_value="")
+            return ":".join([getattr(keys, key) for key in _ordering_display_keys])
 
-            return ":".join([info.get(key, "") for key in keys])
-
-        logger.debug("Sorted order:")
-        for manifest in self.pipeline.manifests:
-            logger.debug(f"metadata: {_get_metadata_str(manifest)}")
+        # Only build the metadata strings if they'll actually be logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sorted order:")
+            for manifest in self.pipeline.manifests:
+                logger.debug(f"metadata: {_get_metadata_str(manifest)}")
 
 class PipelineSupportRenameHash(core.PipelineSupportHandler):
     def pre(self):
@@ -221,6 +230,15 @@ class PipelineSupportRenameHash(core.PipelineSupportHandler):
             }
         }
 
+        # Parse each of the jsonpath patterns once, rather than per manifest. Many of the
+        # patterns are shared between kinds, so parse each distinct pattern only once
+        parsed_patterns = {}
+        for source_kind in pattern_mapping:
+            for target_kind in pattern_mapping[source_kind]:
+                for pattern_str in pattern_mapping[source_kind][target_kind]:
+                    if pattern_str not in parsed_patterns:
+                        parsed_patterns[pattern_str] = jsonpath_ng.parse(pattern_str)
+
         for manifest in self.pipeline.manifests:
             info = manifest.get_info()
 
@@ -234,7 +252,7 @@ class PipelineSupportRenameHash(core.PipelineSupportHandler):
             for target_kind in pattern_mapping[source_kind]:
                 # target kind will be Secret and/or ConfigMap
                 for pattern_str in pattern_mapping[source_kind][target_kind]:
-                    pattern = jsonpath_ng.parse(pattern_str)
+                    pattern = parsed_patterns[pattern_str]
 
                     for pattern_match in pattern.find(manifest.spec):
                         match_value = pattern_match.value
@@ -262,16 +280,19 @@ class PipelineSupportResolveTags(core.PipelineSupportHandler):
         if not self.pipeline.root_pipeline:
             return
 
-        def _resolve_reference(current_manifest, item):
-            if isinstance(item, yaml_types.YamlTag):
-                return item.resolve(current_manifest)
+        # Index the manifests for the lookups performed by the yaml tags. Resolving
+        # doesn't change the manifest list or metadata, so the index remains valid
+        # until all manifests have been resolved
+        self.pipeline.manifest_index = util.index_manifests(self.pipeline.manifests)
 
-            return item
-
-        # Call _resolve_reference for all nodes in the manifest to see if replacement
-        # is required
-        for manifest in self.pipeline.manifests:
-            util.walk_object(manifest.spec, lambda x: _resolve_reference(manifest, x), update=True)
+        # Replace each yaml tag in the manifest with its resolved value. Only the tags are
+        # visited, rather than calling back for every node in the manifest
+        try:
+            for manifest in self.pipeline.manifests:
+                for parent, key in util.iter_yaml_tags(manifest.spec):
+                    parent[key] = parent[key].resolve(manifest)
+        finally:
+            self.pipeline.manifest_index = None
 
 class PipelineSupportCleanup(core.PipelineSupportHandler):
     def pre(self):
@@ -283,21 +304,12 @@ class PipelineSupportCleanup(core.PipelineSupportHandler):
         if not self.pipeline.root_pipeline:
             return
 
-        # List of annotations that we should make sure aren't present on the
-        # output manifests
-        annotations_list = [
-            "kmt/alias",
-            "kmt/pre-hash-name",
-            "kmt/rename-hash"
-        ]
-
         # Remove kmt specific annotations
         for manifest in self.pipeline.manifests:
             annotations = manifest.get_annotations()
 
-            for key in annotations_list:
-                if key in annotations:
-                    annotations.pop(key)
+            for key in _cleanup_annotations:
+                annotations.pop(key, None)
 
             metadata = manifest.get_metadata()
 
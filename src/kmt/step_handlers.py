@@ -1,18 +1,11 @@
 import logging
-import copy
-import yaml
-import re
-import jsonpatch
-import glob
 import sys
+import concurrent.futures
 
 import kmt.core as core
 import kmt.util as util
-import kmt.yaml_types as yaml_types
 import kmt.exception as exception
 
-from .exception import PipelineRunException
-
 logger = logging.getLogger(__name__)
 
 class StepHandlerPipeline(core.StepHandler):
@@ -73,8 +66,9 @@ class StepHandlerPipeline(core.StepHandler):
             # If we're passing manifests to the new pipeline, then the working_manifests
             # list needs to be cleared and the passed manifests removed from the current pipeline
             # manifest list
-            for spec in self.state.working_manifests:
-                self.state.pipeline.manifests.remove(spec)
+            # Rebuild the pipeline manifest list in a single pass, rather than a list.remove per manifest
+            working_ids = set(id(x) for x in self.state.working_manifests)
+            self.state.pipeline.manifests[:] = [x for x in self.state.pipeline.manifests if id(x) not in working_ids]
 
             # Only pass the spec, not the Manifest object itself
             pipeline_manifests = [x.spec for x in self.state.working_manifests]
@@ -94,10 +88,18 @@ class StepHandlerPipeline(core.StepHandler):
         # If pass_manifests is true, then working_manifests would be empty, but if not, then
         # there are still working manifests to be preserved, so append the manifests
         # They also need to be entered in to the pipeline manifest list
-        for spec in pipeline_manifests:
-            new_manifest = core.Manifest(spec, pipeline=self.state.pipeline)
-            self.state.working_manifests.append(new_manifest)
-            self.state.pipeline.manifests.append(new_manifest)
+        new_manifests = [core.Manifest(spec, pipeline=self.state.pipeline) for spec in pipeline_manifests]
+        self.state.working_manifests.extend(new_manifests)
+        self.state.pipeline.manifests.extend(new_manifests)
+
+def _read_import_file(filename):
+    logger.debug(f"import: reading file {filename}")
+
+    # Read as bytes, rather than through the incremental text decoder. The caller only
+    # decodes if the content needs templating, as the yaml parser accepts the bytes directly.
+    # Line endings aren't translated, but both jinja2 and the yaml parser accept \r\n
+    with open(filename, "rb") as file:
+        return file.read()
 
 class StepHandlerImport(core.StepHandler):
     """
@@ -112,8 +114,6 @@ class StepHandlerImport(core.StepHandler):
     def run(self):
         templater = self.state.pipeline.get_templater()
 
-        filenames = set()
-
         import_files = templater.resolve(self.import_files, list)
         import_files = [templater.resolve(x, str) for x in import_files]
 
@@ -121,35 +121,40 @@ class StepHandlerImport(core.StepHandler):
 
         template = templater.resolve(self.template, bool)
 
-        for import_file in import_files:
-            logger.debug(f"import: processing file glob: {import_file}")
-            matches = glob.glob(import_file, recursive=recursive)
-            for match in matches:
-                filenames.add(match)
-
-        # Ensure consistency for load order
-        filenames = list(filenames)
-        filenames.sort()
-
-        for filename in filenames:
-            logger.debug(f"import: reading file {filename}")
-            with open(filename, "r", encoding="utf-8") as file:
-                content = file.read()
+        # Sorted, to ensure consistency for load order
+        filenames = util.expand_file_globs(import_files, recursive=recursive)
+
+        # Reading a file doesn't depend on any other file, so read them concurrently. Templating
+        # and parsing still happen in order, as lookups may refer to manifests from earlier files,
+        # but each file is processed as soon as it has been read, while later files are still
+        # being read
+        if len(filenames) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, len(filenames))) as executor:
+                for filename, content in zip(filenames, executor.map(_read_import_file, filenames)):
+                    self._load_import_content(templater, template, filename, content)
+        else:
+            for filename in filenames:
+                self._load_import_content(templater, template, filename, _read_import_file(filename))
 
-            if template:
-                content = templater.template_if_string(content)
-                if not isinstance(content, str):
-                    raise PipelineRunException("Could not template import text")
+    def _load_import_content(self, templater, template, filename, content):
+        if template:
+            content = templater.template_if_string(content.decode("utf-8"))
+            if not isinstance(content, str):
+                raise exception.PipelineRunException("Could not template import text")
 
-            # Load all documents from the file, after any templating
-            docs = [x for x in util.yaml_load_all(content)]
+        # Load all documents from the file, after any templating. The documents are
+        # converted to manifests as they are parsed, without an intermediate list
+        new_manifests = []
+        for doc in util.yaml_load_all(content):
+            manifest = core.Manifest(doc, pipeline=self.state.pipeline)
+            manifest.local_vars["import_filename"] = filename
 
-            for doc in docs:
-                manifest = core.Manifest(doc, pipeline=self.state.pipeline)
-                manifest.local_vars["import_filename"] = filename
+            new_manifests.append(manifest)
 
-                self.state.pipeline.manifests.append(manifest)
-                self.state.working_manifests.append(manifest)
+        # Add per file, rather than at the end, so that lookups while templating
+        # later files can still see manifests from earlier files
+        self.state.pipeline.manifests.extend(new_manifests)
+        self.state.working_manifests.extend(new_manifests)
 
 class StepHandlerVars(core.StepHandler):
     """
@@ -164,7 +169,7 @@ class StepHandlerVars(core.StepHandler):
         self.recursive = util.extract_property(step_def, "recursive", default=False)
 
     def run(self):
-        working_manifests = self.state.working_manifests.copy()
+        working_manifests = self.state.working_manifests
         templater:core.Templater = self.state.pipeline.get_templater()
 
         # scope
@@ -192,15 +197,10 @@ class StepHandlerVars(core.StepHandler):
         new_vars = {}
 
         # Determine vars files
-        filenames = set()
-        for var_file in vars_files:
-            logger.debug(f"vars: expanding file glob: {var_file}")
-            matches = glob.glob(var_file, recursive=recursive)
-            for match in matches:
-                filenames.add(match)
+        filenames = util.expand_file_globs(vars_files, recursive=recursive)
 
-        filenames = list(filenames)
-        filenames.sort()
+        # Only format the per var messages if they'll actually be logged
+        debug = logger.isEnabledFor(logging.DEBUG)
 
         # Read vars from files
         for filename in filenames:
@@ -209,17 +209,20 @@ class StepHandlerVars(core.StepHandler):
                 lines = file.read().splitlines()
 
                 for line in lines:
-                    split = line.split("=", 1)
-                    if len(split) != 2:
+                    # partition avoids building a list per line
+                    key, sep, value = line.partition("=")
+                    if sep == "":
                         raise exception.KMTConfigException("Invalid format in vars file. Must be 'var_name=...'")
 
-                    new_vars[split[0]] = split[1]
-                    logger.debug(f"Read var_file var {split[0]} -> {split[1]}")
+                    new_vars[key] = value
+                    if debug:
+                        logger.debug(f"Read var_file var {key} -> {value}")
 
         # Read inline vars
         for key in inline:
             new_vars[key] = inline[key]
-            logger.debug(f"Read line var {key} -> {inline[key]}")
+            if debug:
+                logger.debug(f"Read line var {key} -> {inline[key]}")
 
         # Resolve all of the new vars
         # Don't coerce the type to anything, just preserve what it is.
@@ -229,17 +232,17 @@ class StepHandlerVars(core.StepHandler):
 
         # Set vars on manifest or pipeline scope'
         if scope == "pipeline":
-            for key in new_vars:
-                self.state.pipeline.vars[key] = new_vars[key]
-                logger.debug(f"Set pipeline var {key} -> {new_vars[key]}")
+            self.state.pipeline.vars.update(new_vars)
+            if debug:
+                for key in new_vars:
+                    logger.debug(f"Set pipeline var {key} -> {new_vars[key]}")
         elif scope == "manifest":
             for manifest in working_manifests:
-                templater = manifest.get_templater()
-
-                for key in new_vars:
-                    # See above comment
-                    manifest.local_vars[key] = new_vars[key]
-                    logger.debug(f"Set manifest var {key} -> {new_vars[key]}")
+                # The vars have already been resolved, so they are the same for each manifest
+                manifest.local_vars.update(new_vars)
+                if debug:
+                    for key in new_vars:
+                        logger.debug(f"Set manifest var {key} -> {new_vars[key]}")
         else:
             raise exception.KMTConfigException("Invalid value for 'scope'. Must be 'pipeline' or 'manifest'")
 
@@ -258,50 +261,54 @@ class StepHandlerStdin(core.StepHandler):
 
         # Read content from stdin
         logger.debug("stdin: reading document from stdin")
-        content = sys.stdin.read()
+        # As for import, read the bytes and decode once, if stdin has an underlying buffer
+        if hasattr(sys.stdin, "buffer"):
+            content = sys.stdin.buffer.read().decode("utf-8")
+        else:
+            content = sys.stdin.read()
 
         if template:
             content = templater.template_if_string(content)
             if not isinstance(content, str):
-                raise PipelineRunException("Could not template import text")
-
-        # Load all documents from the file, after any templating
-        docs = [x for x in util.yaml_load_all(content)]
+                raise exception.PipelineRunException("Could not template import text")
 
-        for doc in docs:
-            manifest = core.Manifest(doc, self.state.pipeline)
+        # Load all documents from the input, after any templating
+        new_manifests = [core.Manifest(doc, pipeline=self.state.pipeline) for doc in util.yaml_load_all(content)]
 
-            self.state.pipeline.manifests.append(manifest)
-            self.state.working_manifests.append(manifest)
+        self.state.pipeline.manifests.extend(new_manifests)
+        self.state.working_manifests.extend(new_manifests)
 
 class StepHandlerJsonPatch(core.StepHandler):
     def extract(self, step_def):
         self.patches = util.extract_property(step_def, "patches")
 
     def run(self):
-        working_manifests = self.state.working_manifests.copy()
+        # Only import jsonpatch when a pipeline actually uses this step
+        import jsonpatch
 
-        for manifest in working_manifests:
-            templater = manifest.get_templater()
+        working_manifests = self.state.working_manifests
 
-            # Apply the patches to the manifest object
+        def _get_patch_list(templater):
             patches = templater.resolve(self.patches, list)
             patches = [templater.resolve(x, dict) for x in patches]
-            patch_list = jsonpatch.JsonPatch(patches)
-            manifest.spec = patch_list.apply(manifest.spec)
+            return jsonpatch.JsonPatch(patches)
+
+        get_patch_list = self.state.get_manifest_resolver(self.patches, _get_patch_list)
+
+        for manifest in working_manifests:
+            # Apply the patches to the manifest object
+            manifest.spec = get_patch_list(manifest).apply(manifest.spec)
 
 class StepHandlerDelete(core.StepHandler):
     def extract(self, step_def):
         pass
 
     def run(self):
-        working_manifests = self.state.working_manifests.copy()
-
         # Remove all of the remaining working manifests from the working list
         # and pipeline
-        for manifest in working_manifests:
-            self.state.working_manifests.remove(manifest)
-            self.state.pipeline.manifests.remove(manifest)
+        working_ids = set(id(x) for x in self.state.working_manifests)
+        self.state.pipeline.manifests[:] = [x for x in self.state.pipeline.manifests if id(x) not in working_ids]
+        self.state.working_manifests.clear()
 
 class StepHandlerMetadata(core.StepHandler):
     def extract(self, step_def):
@@ -314,44 +321,66 @@ class StepHandlerMetadata(core.StepHandler):
         self.labels = util.extract_property(step_def, "labels")
 
     def run(self):
-        working_manifests = self.state.working_manifests.copy()
+        # Nothing to apply, so don't create a templater for each manifest
+        if self.name is None and self.namespace is None and self.annotations is None and self.labels is None:
+            return
+
+        working_manifests = self.state.working_manifests
+
+        def _resolve_metadata(templater):
+            name = templater.resolve(self.name, (str, type(None)))
+
+            namespace = templater.resolve(self.namespace, (str, type(None)))
+
+            annotations = templater.resolve(self.annotations, (dict, type(None)))
+            if annotations is not None:
+                annotations = {key: templater.resolve(value, str) for key, value in annotations.items()}
+
+            labels = templater.resolve(self.labels, (dict, type(None)))
+            if labels is not None:
+                labels = {key: templater.resolve(value, str) for key, value in labels.items()}
+
+            return (name, namespace, annotations, labels)
+
+        get_metadata = self.state.get_manifest_resolver([self.name, self.namespace, self.annotations, self.labels],
+            _resolve_metadata)
 
         for manifest in working_manifests:
-            templater = manifest.get_templater()
+            name, namespace, annotations, labels = get_metadata(manifest)
 
             spec = manifest.spec
 
-            if spec.get("metadata") is None:
-                spec["metadata"] = {}
+            # Look up the metadata dictionary once, rather than for each property.
+            # Not setdefault, as a key with a null value needs replacing as well
+            metadata = spec.get("metadata")
+            if metadata is None:
+                metadata = {}
+                spec["metadata"] = metadata
 
-            name = templater.resolve(self.name, (str, type(None)))
             if name is not None:
-                spec["metadata"]["name"] = name
+                metadata["name"] = name
 
-            namespace = templater.resolve(self.namespace, (str, type(None)))
             if namespace is not None:
-                spec["metadata"]["namespace"] = namespace
+                metadata["namespace"] = namespace
 
-            annotations = templater.resolve(self.annotations, (dict, type(None)))
             if annotations is not None:
-                if spec["metadata"].get("annotations") is None:
-                    spec["metadata"]["annotations"] = {}
+                if metadata.get("annotations") is None:
+                    metadata["annotations"] = {}
 
-                for key in annotations:
-                    spec["metadata"]["annotations"][key] = templater.resolve(annotations[key], str)
+                metadata["annotations"].update(annotations)
 
-            labels = templater.resolve(self.labels, (dict, type(None)))
             if labels is not None:
-                if spec["metadata"].get("labels") is None:
-                    spec["metadata"]["labels"] = {}
-
-                for key in labels:
-                    spec["metadata"]["labels"][key] = templater.resolve(labels[key], str)
-
-core.default_handlers["pipeline"] = StepHandlerPipeline
-core.default_handlers["import"] = StepHandlerImport
-core.default_handlers["vars"] = StepHandlerVars
-core.default_handlers["stdin"] = StepHandlerStdin
-core.default_handlers["jsonpatch"] = StepHandlerJsonPatch
-core.default_handlers["metadata"] = StepHandlerMetadata
-core.default_handlers["delete"] = StepHandlerDelete
+                if metadata.get("labels") is None:
+                    metadata["labels"] = {}
+
+                metadata["labels"].update(labels)
+
+core.default_handlers.update({
+    "pipeline": StepHandlerPipeline,
+    "import": StepHandlerImport,
+    "vars": StepHandlerVars,
+    "stdin": StepHandlerStdin,
+    "jsonpatch": StepHandlerJsonPatch,
+    "metadata": StepHandlerMetadata,
+    "delete": StepHandlerDelete
+})
@@ -1,6 +1,4 @@
 import logging
-import copy
-import yaml
 import re
 
 import kmt.util as util
@@ -17,7 +15,6 @@ class StepSupportWhen(core.StepSupportHandler):
         self.filter = util.extract_property(step_def, "filter", default=[])
 
     def pre(self):
-        working_manifests = self.state.working_manifests.copy()
         templater = self.state.pipeline.get_templater()
 
         when = templater.resolve(self.when, (list, str))
@@ -31,19 +28,21 @@ class StepSupportWhen(core.StepSupportHandler):
                     self.state.skip_handler = True
                     return
 
-        for manifest in working_manifests:
-            templater = manifest.get_templater()
+        def _keep(manifest):
+            templater = self.state.get_manifest_templater(manifest)
 
             filter = templater.resolve(self.filter, (list, str))
             if isinstance(filter, str):
                 filter = [filter]
 
-            if len(filter) > 0:
-                for condition in filter:
-                    result = templater.resolve("{{" + condition + "}}", bool)
-                    if not result:
-                        self.state.working_manifests.remove(manifest)
-                        break
+            for condition in filter:
+                result = templater.resolve("{{" + condition + "}}", bool)
+                if not result:
+                    return False
+
+            return True
+
+        self.state.working_manifests = [x for x in self.state.working_manifests if _keep(x)]
 
     def post(self):
         pass
@@ -62,46 +61,47 @@ class StepSupportTags(core.StepSupportHandler):
         # Apply tags
         self.apply_tags = util.extract_property(step_def, "apply_tags", default=[])
 
+    def _resolve_tags(self, templater, tags):
+        tags = templater.resolve(tags, list)
+        return set([templater.resolve(x, str) for x in tags])
+
     def pre(self):
-        working_manifests = self.state.working_manifests.copy()
-
-        for manifest in working_manifests:
-            templater = manifest.get_templater()
-
-            match_any_tags = templater.resolve(self.match_any_tags, list)
-            match_any_tags = set([templater.resolve(x, str) for x in match_any_tags])
-            if len(match_any_tags) > 0:
-                # If there are any 'match_any_tags', then at least one of them has to match with the document
-                if len(match_any_tags.intersection(manifest.tags)) == 0:
-                    self.state.working_manifests.remove(manifest)
-                    continue
-
-            match_all_tags = templater.resolve(self.match_all_tags, list)
-            match_all_tags = set([templater.resolve(x, str) for x in match_all_tags])
-            if len(match_all_tags) > 0:
-                # If there are any 'match_all_tags', then all of those tags must match the document
-                for tag in match_all_tags:
-                    if tag not in manifest.tags:
-                        self.state.working_manifests.remove(manifest)
-                        continue
-
-            exclude_tags = templater.resolve(self.exclude_tags, list)
-            exclude_tags = set([templater.resolve(x, str) for x in exclude_tags])
-            if len(exclude_tags) > 0:
-                # If there are any exclude tags and any are present in the manifest, it isn't a match
-                for tag in exclude_tags:
-                    if tag in manifest.tags:
-                        self.state.working_manifests.remove(manifest)
-                        continue
+        def _resolve(templater):
+            return (
+                self._resolve_tags(templater, self.match_any_tags),
+                self._resolve_tags(templater, self.match_all_tags),
+                self._resolve_tags(templater, self.exclude_tags)
+            )
+
+        get_tags = self.state.get_manifest_resolver([self.match_any_tags, self.match_all_tags, self.exclude_tags],
+            _resolve)
+
+        def _keep(manifest):
+            match_any_tags, match_all_tags, exclude_tags = get_tags(manifest)
+
+            # If there are any 'match_any_tags', then at least one of them has to match with the document
+            if len(match_any_tags) > 0 and match_any_tags.isdisjoint(manifest.tags):
+                return False
+
+            # If there are any 'match_all_tags', then all of those tags must match the document
+            if not match_all_tags.issubset(manifest.tags):
+                return False
+
+            # If there are any exclude tags and any are present in the manifest, it isn't a match
+            if not exclude_tags.isdisjoint(manifest.tags):
+                return False
+
+            return True
+
+        self.state.working_manifests = [x for x in self.state.working_manifests if _keep(x)]
 
     def post(self):
 
-        for manifest in self.state.working_manifests:
-            templater = manifest.get_templater()
+        get_apply_tags = self.state.get_manifest_resolver(self.apply_tags,
+            lambda templater: self._resolve_tags(templater, self.apply_tags))
 
-            apply_tags = templater.resolve(self.apply_tags, list)
-            for tag in apply_tags:
-                manifest.tags.add(templater.resolve(tag, str))
+        for manifest in self.state.working_manifests:
+            manifest.tags.update(get_apply_tags(manifest))
 
 class StepSupportMetadata(core.StepSupportHandler):
     def extract(self, step_def):
@@ -117,62 +117,68 @@ class StepSupportMetadata(core.StepSupportHandler):
 
         self.match_name = util.extract_property(step_def, "match_name")
 
+    def _resolve(self, templater):
+        def _compile(pattern):
+            if pattern is None:
+                return None
+
+            return re.compile(pattern)
+
+        def _lower_kinds(kinds):
+            if kinds is None:
+                return None
+
+            if isinstance(kinds, str):
+                kinds = [kinds]
+
+            return frozenset([x.lower() for x in kinds])
+
+        return (
+            _compile(templater.resolve(self.match_group, (str, type(None)))),
+            _compile(templater.resolve(self.match_version, (str, type(None)))),
+            _lower_kinds(templater.resolve(self.match_kind, (list, str, type(None)))),
+            _lower_kinds(templater.resolve(self.exclude_kind, (list, str, type(None)))),
+            _compile(templater.resolve(self.match_namespace, (str, type(None)))),
+            _compile(templater.resolve(self.match_name, (str, type(None))))
+        )
+
     def pre(self):
-        working_manifests = self.state.working_manifests.copy()
+        get_matches = self.state.get_manifest_resolver([self.match_group, self.match_version, self.match_kind,
+            self.exclude_kind, self.match_namespace, self.match_name], self._resolve)
 
-        for manifest in working_manifests:
-            templater = manifest.get_templater()
-            info = manifest.get_info()
+        def _keep(manifest):
+            match_group, match_version, match_kind, exclude_kind, match_namespace, match_name = get_matches(manifest)
 
-            group = info["group"]
-            version = info["version"]
-            kind = info["kind"]
-            namespace = info["namespace"]
-            name = info["name"]
+            info = manifest.get_info()
 
             # k8s group match
-            match_group = templater.resolve(self.match_group, (str, type(None)))
-            if match_group is not None and not re.search(match_group, group):
-                self.state.working_manifests.remove(manifest)
-                continue
+            if match_group is not None and not match_group.search(info["group"]):
+                return False
 
             # k8s version match
-            match_version = templater.resolve(self.match_version, (str, type(None)))
-            if match_version is not None and not re.search(match_version, version):
-                self.state.working_manifests.remove(manifest)
-                continue
-
-            # k8s kind match
-            match_kind = templater.resolve(self.match_kind, (list, str, type(None)))
-            if match_kind is not None:
-                if isinstance(match_kind, str):
-                    match_kind = [match_kind]
+            if match_version is not None and not match_version.search(info["version"]):
+                return False
 
-                if not any((x.lower() == kind.lower()) for x in match_kind):
-                    self.state.working_manifests.remove(manifest)
-                    continue
+            # k8s kind match. An empty list matches nothing, without needing the kind, and
+            # a manifest may not have a kind
+            if match_kind is not None and (len(match_kind) == 0 or (info["kind"] or "").lower() not in match_kind):
+                return False
 
             # k8s kind exclude
-            exclude_kind = templater.resolve(self.exclude_kind, (list, str, type(None)))
-            if exclude_kind is not None:
-                if isinstance(exclude_kind, str):
-                    exclude_kind = [exclude_kind]
-
-                if any((x.lower() == kind.lower()) for x in exclude_kind):
-                    self.state.working_manifests.remove(manifest)
-                    continue
+            if exclude_kind and (info["kind"] or "").lower() in exclude_kind:
+                return False
 
             # k8s namespace match
-            match_namespace = templater.resolve(self.match_namespace, (str, type(None)))
-            if match_namespace is not None and not re.search(match_namespace, namespace):
-                self.state.working_manifests.remove(manifest)
-                continue
+            if match_namespace is not None and not match_namespace.search(info["namespace"]):
+                return False
 
             # k8s name match
-            match_name = templater.resolve(self.match_name, (str, type(None)))
-            if match_name is not None and not re.search(match_name, name):
-                self.state.working_manifests.remove(manifest)
-                continue
+            if match_name is not None and not match_name.search(info["name"]):
+                return False
+
+            return True
+
+        self.state.working_manifests = [x for x in self.state.working_manifests if _keep(x)]
 
     def post(self):
         pass
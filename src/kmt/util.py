@@ -1,11 +1,15 @@
 
 import logging
+import os
 import hashlib
 import textwrap
 import yaml
 import copy
 import jinja2
 import re
+import glob
+import functools
+import concurrent.futures
 
 from jinja2.meta import find_undeclared_variables
 
@@ -15,25 +19,46 @@ import kmt.core as core
 
 logger = logging.getLogger(__name__)
 
+# Cache the hashlib constructors, so hash_string doesn't need to resolve the hash
+# type by name for each call
+_hash_constructors = {name: getattr(hashlib, name) for name in hashlib.algorithms_guaranteed if hasattr(hashlib, name)}
+
+# Patterns consisting only of these characters have no regex meaning and can be
+# matched with a plain substring test
+_literal_pattern = re.compile(r"[A-Za-z0-9_\-]+")
+
+# Characters that make a path a glob pattern, as for glob.glob
+_glob_chars = re.compile(r"[*?\[]")
+
+# libyaml backed loader and dumper, if available, which run the parser and emitter in C.
+# The dumper output loads to the same values as SafeDumper output, but isn't always
+# byte identical, as libyaml folds some long double quoted strings differently
+_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# Hashes are always taken over the pure python dumper output, so a hash (and any hash
+# rename suffix) doesn't depend on whether PyYAML was built with libyaml
+_hash_dumper = yaml.SafeDumper
+
 def validate(val, message, extype=exception.ValidationException):
     if not val:
         raise extype(message)
 
-def hash_string(source, hash_type="sha1", encoding="utf-8"):
-    validate(isinstance(source, str), "Invalid source string supplied to hash_string")
-    validate(isinstance(hash_type, str), "Invalid hash type supplied to hash_object")
-    validate(isinstance(encoding, str), "Invalid encoding supplied to hash_object")
-
-    # Determine whether we should generate a short sum
+def _new_hash(hash_type):
+    # Short sums are derived from sha256
     method = hash_type
     if hash_type == "short8" or hash_type == "short10":
         method = "sha256"
 
     # Get a reference to the object to use for hashing
-    instance = hashlib.new(method)
+    # The hash is used for naming and change detection, not security
+    constructor = _hash_constructors.get(method)
+    if constructor is not None:
+        return constructor(usedforsecurity=False)
 
-    instance.update(str(source).encode(encoding))
+    return hashlib.new(method, usedforsecurity=False)
 
+def _hash_result(instance, hash_type):
     result = instance.hexdigest()
 
     if hash_type == "short8":
@@ -47,10 +72,40 @@ def hash_string(source, hash_type="sha1", encoding="utf-8"):
 
     return result
 
+def hash_string(source, hash_type="sha1", encoding="utf-8"):
+    validate(isinstance(source, (str, bytes, bytearray, memoryview)), "Invalid source string supplied to hash_string")
+    validate(isinstance(hash_type, str), "Invalid hash type supplied to hash_string")
+    validate(isinstance(encoding, str), "Invalid encoding supplied to hash_string")
+
+    instance = _new_hash(hash_type)
+
+    # Binary sources are hashed as is. Only str requires encoding
+    if isinstance(source, str):
+        instance.update(source.encode(encoding))
+    else:
+        instance.update(source)
+
+    return _hash_result(instance, hash_type)
+
+def hash_file(filename, hash_type="sha1"):
+    validate(isinstance(filename, str), "Invalid filename supplied to hash_file")
+    validate(isinstance(hash_type, str), "Invalid hash type supplied to hash_file")
+
+    # Hash the file content in chunks, rather than reading the whole file in to memory
+    with open(filename, "rb") as file:
+        if hasattr(hashlib, "file_digest"):
+            instance = hashlib.file_digest(file, lambda: _new_hash(hash_type))
+        else:
+            instance = _new_hash(hash_type)
+            for chunk in iter(lambda: file.read(2**18), b""):
+                instance.update(chunk)
+
+    return _hash_result(instance, hash_type)
+
 def hash_object(source, hash_type="sha1"):
     validate(source is not None, "Invalid source supplied to hash_object")
 
-    text = yaml_dump(source)
+    text = _yaml_dump_hash(source)
 
     return hash_string(text, hash_type=hash_type)
 
@@ -63,7 +118,10 @@ def hash_manifest(source, hash_type="sha1"):
     if "metadata" in new_obj:
         new_obj.pop("metadata")
 
-    text = yaml_dump(new_obj)
+    # Always hash the serialised spec, rather than the source document the manifest was
+    # loaded from. The source includes metadata and won't reflect changes made by the
+    # pipeline steps, so the hash would depend on how the manifest was produced.
+    text = _yaml_dump_hash(new_obj)
 
     return hash_string(text, hash_type=hash_type)
 
@@ -126,6 +184,96 @@ def walk_object(object, callback, update=False):
 
     return object
 
+def iter_yaml_tags(object):
+    """
+    Generator that yields a (parent, key) tuple for each yaml tag object found within the object,
+    visiting nodes in the same order as walk_object. The caller may replace parent[key] before
+    resuming and any dict or list that replaces the tag will be walked as well. Cheaper than
+    walk_object with a callback when only the tags are of interest
+    """
+    validate(object is not None, "Invalid object supplied to iter_yaml_tags")
+
+    if not isinstance(object, (dict, list)):
+        return
+
+    visited = set()
+    item_list = [object]
+
+    while len(item_list) > 0:
+        if len(item_list) > 10000:
+            raise exception.RecursionLimitException("Exceeded the maximum recursion depth limit")
+
+        current = item_list.pop()
+
+        # Check if we've seen this object before
+        if id(current) in visited:
+            continue
+
+        visited.add(id(current))
+
+        if isinstance(current, dict):
+            for key in current:
+                if isinstance(current[key], yaml_types.YamlTag):
+                    yield (current, key)
+
+                if isinstance(current[key], (dict, list)):
+                    item_list.append(current[key])
+        else:
+            index = 0
+            while index < len(current):
+                if isinstance(current[index], yaml_types.YamlTag):
+                    yield (current, index)
+
+                if isinstance(current[index], (dict, list)):
+                    item_list.append(current[index])
+
+                index = index + 1
+
+def clone_object(source, memo=None):
+    """
+    Deep copy of an object. dict and list values are copied directly, which is much faster
+    than copy.deepcopy for the plain yaml data that vars and manifests are made of. Other
+    types are passed to copy.deepcopy. Shared references and loops are preserved, as
+    with copy.deepcopy
+    """
+    source_type = type(source)
+
+    if source_type in (str, int, float, bool, type(None)):
+        return source
+
+    if memo is None:
+        memo = {}
+
+    existing = memo.get(id(source))
+    if existing is not None:
+        return existing
+
+    if source_type is dict:
+        result = {}
+        memo[id(source)] = result
+
+        for key, value in source.items():
+            result[key] = clone_object(value, memo)
+
+        return result
+
+    if source_type is list:
+        result = []
+        memo[id(source)] = result
+
+        for value in source:
+            result.append(clone_object(value, memo))
+
+        return result
+
+    return copy.deepcopy(source, memo)
+
+@functools.lru_cache(maxsize=256)
+def _is_type_tuple(types):
+    # The same few type tuples are passed to coerce_value for every resolve, so only
+    # check the members of each tuple once
+    return all(isinstance(x, type) for x in types)
+
 def coerce_value(types, val):
     if types is None:
         # Nothing to do here
@@ -134,8 +282,7 @@ def coerce_value(types, val):
     if isinstance(types, type):
         types = (types,)
 
-    validate(isinstance(types, tuple) and all(isinstance(x, type) for x in types),
-        "Invalid types passed to coerce_value")
+    validate(isinstance(types, tuple) and _is_type_tuple(types), "Invalid types passed to coerce_value")
 
     parsed = None
 
@@ -205,8 +352,34 @@ def extract_property(spec, key, /, default=None, required=False):
 
     return val
 
+def has_template_markers(value):
+    """
+    Determines whether a string contains any jinja2 template markers
+    """
+    return isinstance(value, str) and ("{{" in value or "{%" in value or "{#" in value)
+
+def contains_template(value):
+    """
+    Determines whether any string within the value contains jinja2 template markers.
+    Values without templating resolve to the same result for any set of vars
+    """
+    if value is None:
+        return False
+
+    found = False
+
+    def _check(item):
+        nonlocal found
+        if has_template_markers(item):
+            found = True
+
+    walk_object(value, _check)
+
+    return found
+
 def _get_template_str_vars(template_str, environment:jinja2.Environment):
-    if not isinstance(template_str, str):
+    # Without any markers, there can't be any variable references
+    if not has_template_markers(template_str):
         return set()
 
     ast = environment.parse(template_str)
@@ -231,7 +404,7 @@ def resolve_var_refs(source_vars:dict, environment:jinja2.Environment, inplace:b
 
     working_vars = source_vars
     if not inplace:
-        working_vars = copy.deepcopy(source_vars)
+        working_vars = clone_object(source_vars)
 
     # Create a map of keys to the vars the value references
     for key in working_vars:
@@ -293,28 +466,66 @@ def _template_if_string(source, environment:jinja2.Environment, template_vars:di
     if not isinstance(source, str):
         return source
 
+    # See Templater.template_if_string
+    if not has_template_markers(source) and "\r" not in source:
+        return source
+
     template = environment.from_string(source)
     return template.render(template_vars)
 
-def yaml_dump(source):
-    dumper = yaml.SafeDumper
+def _yaml_dump_hash(source):
+    # As for yaml_dump, but with the dumper used for hashing. The output is utf-8 bytes,
+    # which avoids a decode and re-encode when hashing
+    return yaml.dump(source, Dumper=_hash_dumper, encoding="utf-8", explicit_start=True, sort_keys=False, indent=2)
 
-    return yaml.dump(source, Dumper=dumper, explicit_start=True, sort_keys=False, indent=2)
+def yaml_dump(source):
+    return yaml.dump(source, Dumper=_dumper, explicit_start=True, sort_keys=False, indent=2)
 
 def yaml_dump_all(source):
-    dumper = yaml.SafeDumper
-
-    return yaml.dump_all(source, Dumper=dumper, explicit_start=True, sort_keys=False, indent=2)
+    return yaml.dump_all(source, Dumper=_dumper, explicit_start=True, sort_keys=False, indent=2)
 
 def yaml_load(source):
-    loader = yaml.SafeLoader
-
-    return yaml.load(source, Loader=loader)
+    return yaml.load(source, Loader=_loader)
 
 def yaml_load_all(source):
-    loader = yaml.SafeLoader
+    return yaml.load_all(source, Loader=_loader)
+
+def expand_file_globs(patterns, recursive=False):
+    """
+    Expands a list of file glob patterns and returns the sorted, unique list of matching paths
+    """
+    validate(isinstance(patterns, list) and all(isinstance(x, str) for x in patterns),
+        "Invalid patterns supplied to expand_file_globs")
+    validate(isinstance(recursive, bool), "Invalid recursive flag supplied to expand_file_globs")
 
-    return yaml.load_all(source, Loader=loader)
+    filenames = set()
+    glob_patterns = []
+
+    # Expand repeated patterns only once, as each glob rescans the directories
+    for pattern in set(patterns):
+        # Plain paths don't need glob, just a check that the path exists
+        if _glob_chars.search(pattern) is None:
+            if os.path.lexists(pattern):
+                filenames.add(pattern)
+
+            continue
+
+        glob_patterns.append(pattern)
+
+    def _expand(pattern):
+        logger.debug(f"Expanding file glob: {pattern}")
+        return glob.glob(pattern, recursive=recursive)
+
+    # Globbing is mostly directory scanning, so expand multiple patterns concurrently
+    if len(glob_patterns) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(glob_patterns))) as executor:
+            for matches in executor.map(_expand, glob_patterns):
+                filenames.update(matches)
+    else:
+        for pattern in glob_patterns:
+            filenames.update(_expand(pattern))
+
+    return sorted(filenames)
 
 def check_find_manifests_keys(search:dict):
     validate(isinstance(search, dict), "Invalid search supplied to check_find_manifests_keys")
@@ -337,49 +548,114 @@ def check_find_manifests_keys(search:dict):
     if len(errored) > 0:
         raise exception.PipelineRunException(f"Invalid keys or invalid key value found on lookup: {errored}")
 
-def find_manifests(search, manifests, *, multiple, current_namespace=None):
+def index_manifests(manifests):
+    """
+    Creates an index of (kind, namespace) to manifest positions, which can be passed to
+    find_manifests to narrow the manifests considered. The index is only valid while the
+    manifest list and the kind and namespace of each manifest are unchanged
+    """
+    validate(isinstance(manifests, list) and all(isinstance(x, core.Manifest) for x in manifests),
+        "Invalid manifests provided to index_manifests")
+
+    index = {}
+
+    for position, manifest in enumerate(manifests):
+        keys = manifest.get_keys()
+
+        key = (keys.kind, keys.namespace)
+        if key not in index:
+            index[key] = []
+
+        index[key].append(position)
+
+    return index
+
+@functools.lru_cache(maxsize=256)
+def _compile_name_pattern(pattern):
+    # Literal patterns skip the regex engine entirely, using a substring test, which
+    # has the same semantics as re.search. Returns a (literal, compiled regex) tuple,
+    # with only one of them set
+    if _literal_pattern.fullmatch(pattern):
+        return (pattern, None)
+
+    return (None, re.compile(pattern))
+
+def find_manifests(search, manifests, *, multiple, current_namespace=None, index=None):
     validate(isinstance(search, dict) and all(isinstance(x, (str, type(None))) for x in search.values()),
         "Invalid search criteria provided to find_manifests")
-    validate(isinstance(manifests, list) and all(isinstance(x, core.Manifest) for x in manifests),
+    # A prebuilt index means index_manifests has already checked every manifest in the list,
+    # so don't walk the whole list again for each lookup
+    validate(isinstance(manifests, list) and (index is not None or all(isinstance(x, core.Manifest) for x in manifests)),
         "Invalid manifests provided to find_manifests")
     validate(isinstance(multiple, bool), "Invalid multiple parameter to find_manifests")
     validate(current_namespace is None or isinstance(current_namespace, str),
         "Invalid current_namespace provided to find_manifests")
+    validate(index is None or isinstance(index, dict), "Invalid index provided to find_manifests")
+
+    # Use the index, if supplied, to narrow the manifests to check down to those with a
+    # matching kind and namespace. The checks below still apply to these candidates.
+    if index is not None and "kind" in search:
+        if "namespace" in search:
+            namespaces = {search["namespace"]}
+        else:
+            namespaces = {None, current_namespace}
+
+        positions = []
+        for namespace in namespaces:
+            positions.extend(index.get((search["kind"], namespace), []))
+
+        # Preserve the original manifest order
+        positions.sort()
+        manifests = [manifests[x] for x in positions]
+
+    # Compile the name pattern once, rather than per manifest
+    pattern_literal = None
+    pattern_re = None
+    if search.get("pattern") is not None:
+        pattern_literal, pattern_re = _compile_name_pattern(search["pattern"])
 
     matches = []
 
     for manifest in manifests:
 
-        info = manifest.get_info()
+        keys = manifest.get_keys()
 
-        if "group" in search and search["group"] != info["group"]:
+        if "group" in search and search["group"] != keys.group:
             continue
 
-        if "version" in search and search["version"] != info["version"]:
+        if "version" in search and search["version"] != keys.version:
             continue
 
-        if "kind" in search and search["kind"] != info["kind"]:
+        if "kind" in search and search["kind"] != keys.kind:
             continue
 
-        if "api_version" in search and search["api_version"] != info["api_version"]:
+        if "api_version" in search and search["api_version"] != keys.api_version:
             continue
 
         if "namespace" in search:
-            if search["namespace"] != info["namespace"]:
+            if search["namespace"] != keys.namespace:
                 continue
-        elif info["namespace"] is not None and info["namespace"] != current_namespace:
+        elif keys.namespace is not None and keys.namespace != current_namespace:
             # If no namespace has been defined in the lookup, we will match on
             # the current namespace and any resource without a namespace.
             continue
 
-        if "pattern" in search and search["pattern"] is not None and not re.search(search["pattern"], info["name"]):
+        if pattern_literal is not None and pattern_literal not in keys.name:
             continue
 
-        if "alias" in search and (search["alias"] != info["alias"] or search["alias"] == info["name"]):
+        if pattern_re is not None and pattern_re.search(keys.name) is None:
+            continue
+
+        if "alias" in search and (search["alias"] != keys.alias or search["alias"] == keys.name):
             continue
 
         matches.append(manifest)
 
+        # A second match is enough to know there isn't a single match, so there is no
+        # need to check the remaining manifests
+        if not multiple and len(matches) > 1:
+            break
+
     if multiple:
         return matches
 
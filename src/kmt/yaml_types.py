@@ -1,4 +1,3 @@
-import re
 import yaml
 
 import kmt.core as core
@@ -24,16 +23,20 @@ class YamlTag:
 
         return metadata.get("namespace")
 
-    def get_manifests(self, scope):
-        pipeline = None
+    def get_pipeline(self, scope):
         if isinstance(scope, core.Manifest):
-            pipeline = scope.pipeline
-        elif isinstance(scope, core.Pipeline):
-            pipeline = scope
-        else:
-            raise exception.KMTInternalException("Invalid scope passed to get_manifests. Must be Manifest or Pipeline")
+            return scope.pipeline
+
+        if isinstance(scope, core.Pipeline):
+            return scope
 
-        return pipeline.manifests
+        raise exception.KMTInternalException("Invalid scope passed to get_pipeline. Must be Manifest or Pipeline")
+
+    def get_manifests(self, scope):
+        return self.get_pipeline(scope).manifests
+
+    def get_manifest_index(self, scope):
+        return self.get_pipeline(scope).manifest_index
 
 class Lookup(YamlTag):
     def __init__(self, spec):
@@ -45,8 +48,9 @@ class Lookup(YamlTag):
     def resolve(self, scope):
         current_namespace = self.get_current_namespace(scope)
         manifests = self.get_manifests(scope)
+        index = self.get_manifest_index(scope)
 
-        manifest = util.find_manifests(self.spec, manifests, multiple=False, current_namespace=current_namespace)
+        manifest = util.find_manifests(self.spec, manifests, multiple=False, current_namespace=current_namespace, index=index)
 
         return manifest.spec
 
@@ -60,8 +64,9 @@ class LookupName(YamlTag):
     def resolve(self, scope):
         current_namespace = self.get_current_namespace(scope)
         manifests = self.get_manifests(scope)
+        index = self.get_manifest_index(scope)
 
-        item = util.find_manifests(self.spec, manifests, multiple=False, current_namespace=current_namespace)
+        item = util.find_manifests(self.spec, manifests, multiple=False, current_namespace=current_namespace, index=index)
 
         metadata = item.spec.get("metadata")
         if not isinstance(metadata, dict):
@@ -90,8 +95,9 @@ class LookupHash(YamlTag):
     def resolve(self, scope):
         current_namespace = self.get_current_namespace(scope)
         manifests = self.get_manifests(scope)
+        index = self.get_manifest_index(scope)
 
-        item = util.find_manifests(self.spec, manifests, multiple=False, current_namespace=current_namespace)
+        item = util.find_manifests(self.spec, manifests, multiple=False, current_namespace=current_namespace, index=index)
 
         return util.hash_manifest(item.spec, hash_type=self.spec["hash_type"])
 
@@ -104,13 +110,14 @@ class LookupConfigMap(YamlTag):
     def resolve(self, scope):
         current_namespace = self.get_current_namespace(scope)
         manifests = self.get_manifests(scope)
+        index = self.get_manifest_index(scope)
 
         spec = {
             "kind": "ConfigMap",
             "alias": self.name
         }
 
-        matches = util.find_manifests(spec, manifests, multiple=True, current_namespace=current_namespace)
+        matches = util.find_manifests(spec, manifests, multiple=True, current_namespace=current_namespace, index=index)
 
         if len(matches) < 1:
             raise exception.KMTTemplateException(f"Could not find matching configmap: {self.name}")
@@ -131,13 +138,14 @@ class LookupSecret(YamlTag):
     def resolve(self, scope):
         current_namespace = self.get_current_namespace(scope)
         manifests = self.get_manifests(scope)
+        index = self.get_manifest_index(scope)
 
         spec = {
             "kind": "Secret",
             "alias": self.name
         }
 
-        matches = util.find_manifests(spec, manifests, multiple=True, current_namespace=current_namespace)
+        matches = util.find_manifests(spec, manifests, multiple=True, current_namespace=current_namespace, index=index)
 
         if len(matches) < 1:
             raise exception.KMTTemplateException(f"Could not find matching secret: {self.name}")
@@ -205,6 +213,9 @@ for type_ref, representer in representers:
     yaml.SafeDumper.add_representer(type_ref, representer)
     yaml.Dumper.add_representer(type_ref, representer)
 
+    if hasattr(yaml, "CSafeDumper"):
+        yaml.CSafeDumper.add_representer(type_ref, representer)
+
 #
 # yaml constructors
 constructors = [
@@ -218,3 +229,6 @@ constructors = [
 for type_ref, constructor in constructors:
     yaml.SafeLoader.add_constructor(type_ref, constructor)
     yaml.Loader.add_constructor(type_ref, constructor)
+
+    if hasattr(yaml, "CSafeLoader"):
+        yaml.CSafeLoader.add_constructor(type_ref, constructor)
@@ -0,0 +1,74 @@
+import kmt.core as core
+import kmt.step_handlers
+import kmt.step_support
+import kmt.pipeline_support
+import kmt.j2support
+
+# Characters that yaml either rejects (C1 controls) or treats as line breaks in a
+# double quoted scalar, so they must reach the parser escaped
+_include_content = "a\u0085b\u009fc\u2028d\u2029e\u007ff \"quoted\" \\ \t\n"
+
+def _run_include(tmp_path, monkeypatch, include_args, content=_include_content):
+    (tmp_path / "inc.txt").write_text(content, encoding="utf-8")
+    (tmp_path / "manifest.yaml").write_text(
+        "apiVersion: v1\n"
+        "kind: ConfigMap\n"
+        "metadata:\n"
+        "  name: test\n"
+        "data:\n"
+        f"  value: \"{{{{ include_file_str({include_args}) }}}}\"\n",
+        encoding="utf-8")
+    (tmp_path / "config.yaml").write_text(
+        "pipeline:\n"
+        "  - import:\n"
+        "      files:\n"
+        "        - manifest.yaml\n",
+        encoding="utf-8")
+
+    # The pipeline changes directory to the config directory, so restore it afterwards
+    monkeypatch.chdir(tmp_path)
+
+    manifests = core.Pipeline(str(tmp_path)).run()
+
+    assert len(manifests) == 1
+    return manifests[0].spec["data"]["value"]
+
+def test_include_file_str_templated_non_ascii(tmp_path, monkeypatch):
+    value = _run_include(tmp_path, monkeypatch, "'inc.txt', template=True")
+
+    assert value == _include_content
+
+def test_include_file_str_non_ascii(tmp_path, monkeypatch):
+    # Without templating, the content is escaped in chunks as it is read
+    value = _run_include(tmp_path, monkeypatch, "'inc.txt'")
+
+    assert value == _include_content
+
+def test_include_file_str_non_ascii_chunked(tmp_path, monkeypatch):
+    # Large enough to be read in multiple chunks, with both ascii only and non-ascii chunks
+    content = "x" * 70000 + _include_content
+    value = _run_include(tmp_path, monkeypatch, "'inc.txt'", content=content)
+
+    assert value == content
+
+def test_base64_decode_str_and_bytes():
+    assert kmt.j2support.filter_base64_decode("aGVsbG8=") == "hello"
+    assert kmt.j2support.filter_base64_decode(b"aGVsbG8=") == "hello"
+
+    # Characters outside the base64 alphabet are discarded, including non-ascii characters
+    assert kmt.j2support.filter_base64_decode("aGVsébG8=") == "hello"
+
+def test_base64_encode_many():
+    # Lengths on and off 3 byte boundaries, empty and non-ascii values, and non-str values
+    values = ["", "a", "ab", "abc", "abcd", "abcde", "abcdef", "café", 12345, "x" * 100]
+
+    assert kmt.j2support.filter_base64_encode_many(values) == \
+        [kmt.j2support.filter_base64_encode(x) for x in values]
+
+    assert kmt.j2support.filter_base64_encode_many([]) == []
+
+def test_base64_encode_many_aligned():
+    # All values are whole 3 byte groups, so there are no tails to encode
+    values = ["abc", "defghi", ""]
+
+    assert kmt.j2support.filter_base64_encode_many(values) == ["YWJj", "ZGVmZ2hp", ""]
@@ -0,0 +1,34 @@
+import kmt.core as core
+import kmt.step_handlers
+import kmt.step_support as step_support
+import kmt.pipeline_support
+import kmt.j2support
+
+def _filter_metadata(tmp_path, monkeypatch, step_def):
+    (tmp_path / "config.yaml").write_text("pipeline: []\n", encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    pipeline = core.Pipeline(str(tmp_path))
+
+    no_kind = core.Manifest({"apiVersion": "v1", "metadata": {"name": "a"}}, pipeline=pipeline)
+    configmap = core.Manifest({"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "b"}},
+        pipeline=pipeline)
+
+    state = core.PipelineStepState(pipeline=pipeline, working_manifests=[no_kind, configmap])
+
+    handler = step_support.StepSupportMetadata()
+    handler.init(state)
+    handler.extract(step_def)
+    handler.pre()
+
+    return [x.spec["metadata"]["name"] for x in state.working_manifests]
+
+def test_metadata_empty_kind_lists_without_kind(tmp_path, monkeypatch):
+    # An empty match list matches nothing and an empty exclude list excludes nothing,
+    # without needing the manifest kind
+    assert _filter_metadata(tmp_path, monkeypatch, {"match_kind": []}) == []
+    assert _filter_metadata(tmp_path, monkeypatch, {"exclude_kind": []}) == ["a", "b"]
+
+def test_metadata_kind_match_without_kind(tmp_path, monkeypatch):
+    assert _filter_metadata(tmp_path, monkeypatch, {"match_kind": ["configmap"]}) == ["b"]
+    assert _filter_metadata(tmp_path, monkeypatch, {"exclude_kind": "ConfigMap"}) == ["a"]
@@ -0,0 +1,26 @@
+import kmt.util as util
+
+# A long line ending in a space, followed by another line. The libyaml emitter folds
+# this differently to the pure python emitter
+_manifest = {
+    "apiVersion": "v1",
+    "kind": "ConfigMap",
+    "metadata": {
+        "name": "test"
+    },
+    "data": {
+        "long": "a" * 70 + " \nsecond line",
+        "k": "v"
+    }
+}
+
+def test_hash_manifest_long_multiline_string():
+    # Pinned, so that existing hash rename suffixes don't change
+    assert util.hash_manifest(_manifest) == "66a6dc3895c7ce0f234b716cbbd69cf76c662c1d"
+    assert util.hash_manifest(_manifest, hash_type="short10") == "cda98d47aa"
+    assert util.hash_manifest(_manifest, hash_type="short8") == "964ab688"
+
+def test_hash_manifest_ignores_metadata():
+    renamed = dict(_manifest, metadata={"name": "other"})
+
+    assert util.hash_manifest(renamed) == util.hash_manifest(_manifest)